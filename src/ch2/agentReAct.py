@@ -1,115 +1,278 @@
-import re, os
+import re, os, io
+import asyncio, inspect
+from concurrent.futures import ThreadPoolExecutor
 
 from loguru import logger
 
-from client import LLMClient
+from client import LLMClient, LLMBatcher
 from executor import ToolExecutor
 from tools import search
 from util import load_system_prompt
 
 
+# 预编译解析用的正则，避免每一步都查找 re 的内部缓存
+_THOUGHT_RE = re.compile(r"Thought:\s*(.*)") # 不包括换行符
+_ACTION_RE = re.compile(r"Action:\s*(.*)")
+_TOOLCALL_RE = re.compile(r"(\w+)\[(.*)\]", re.DOTALL)
+# 最终答案在遇到这些字段开头的行时结束，避免把模型之后多输出的内容并入答案
+_FIELD_PREFIXES = ("Thought:", "Action:", "Observation:")
+
+
+class _ActionStopDetector:
+    """
+    流式输出的停止条件，每一步新建一个。逐段接收增量内容，只检查新出现的完整行:
+    最后一行Action之后模型又输出了其他内容(如自行编造的Observation)，说明本步的
+    Action已全部给出。出现Finish时不提前停止，因为最终答案可能跨多行。
+    """
+    def __init__(self):
+        self._pending = "" # 尚未换行的当前行
+        self._seen_action = False
+        self._awaiting_action = False # "Action:" 后换行，工具调用写在下一行
+        self._finishing = False
+
+    def __call__(self, content: str) -> bool:
+        if "\n" not in content:
+            self._pending += content
+            return False
+        lines = (self._pending + content).split("\n")
+        self._pending = lines.pop()
+        return any(self._feed_line(line.strip()) for line in lines)
+
+    def _feed_line(self, line: str) -> bool:
+        if self._finishing or not line:
+            return False
+        if line.startswith("Action:") or self._awaiting_action:
+            action = line[len("Action:"):].strip() if line.startswith("Action:") else line
+            self._awaiting_action = not action
+            if action.startswith("Finish"):
+                self._finishing = True
+            elif action:
+                self._seen_action = True
+            return False
+        return self._seen_action
+
+
 class ReActAgent:
-    def __init__(self, llm_client: LLMClient, tool_executor: ToolExecutor, system_prompt_tmpl: str, max_steps: int = 5):
+    def __init__(self, llm_client: LLMClient, tool_executor: ToolExecutor, system_prompt_tmpl: str, max_steps: int = 5,
+                 tool_timeout: float = None, tool_pool: ThreadPoolExecutor = None):
         self.llm_client = llm_client
         self.tool_executor = tool_executor
         self.max_steps = max_steps
-        self.history = []
+        self.tool_timeout = tool_timeout
+        self._history_buf = io.StringIO()
         self.system_prompt_tmpl = system_prompt_tmpl
+        # 模板必须以 {history} 结尾:这样每一步的提示词都是上一步的追加，
+        # 开启了前缀缓存(如 vLLM 的 automatic prefix caching)的服务端可以复用KV缓存
+        if not system_prompt_tmpl.endswith("{history}"):
+            raise ValueError("ReAct提示词模板必须以 {history} 结尾。")
+        self._prefix_tmpl = system_prompt_tmpl[:-len("{history}")]
+        # 阻塞型工具(如 search)在线程池中执行，使同一步的多个Action可以并行；
+        # 多个智能体可以传入同一个线程池共享，此时线程池由调用方负责关闭
+        self._owns_tool_pool = tool_pool is None
+        self._tool_pool = tool_pool or ThreadPoolExecutor(max_workers=8)
+
+    def close(self):
+        """关闭智能体自己创建的线程池；外部传入的线程池不受影响。"""
+        if self._owns_tool_pool:
+            self._tool_pool.shutdown(wait=False, cancel_futures=True)
+
+    def _scan(self, text: str):
+        """
+        逐行扫描一遍LLM的输出，提取Thought、所有工具Action以及Finish的最终答案。
+        只做前缀判断，不经过正则引擎。Finish的答案可以跨多行、包含"[1]"之类的引用，
+        规则见 _finish_answer；没有闭合的Finish也当作最终答案。
+        """
+        thought = None
+        actions = []
+        final_answer = None
+        pos = 0
+        for line in text.splitlines(keepends=True):
+            pos += len(line)
+            line = line.strip()
+            if thought is None and line.startswith("Thought:"):
+                thought = line[len("Thought:"):].strip()
+            elif line.startswith("Action:"):
+                action = line[len("Action:"):].strip()
+                if action.startswith("Finish["):
+                    final_answer = self._finish_answer(action[len("Finish["):] + "\n" + text[pos:])
+                    break
+                if action:
+                    actions.append(action)
+        return thought, actions, final_answer
+
+    def _finish_answer(self, tail: str) -> str:
+        """
+        从 Finish[ 之后的文本中取出最终答案:先截到下一个以 Thought:/Action:/Observation:
+        开头的行之前，再截到其中最后一个"]"为止。
+        """
+        lines = tail.split("\n")
+        answer_lines = lines[:1]
+        for line in lines[1:]:
+            if line.lstrip().startswith(_FIELD_PREFIXES):
+                break
+            answer_lines.append(line)
+        tail = "\n".join(answer_lines)
+        end = tail.rfind("]")
+        return (tail[:end] if end >= 0 else tail).strip()
 
     def _parse_output(self, text: str):
-        """解析LLM的输出，提取Thought和Action。"""
-        thought_match = re.search(r"Thought: (.*)", text) # 不包括换行符
-        action_match = re.search(r"Action: (.*)", text)
+        """解析LLM的输出，提取Thought、所有Action和最终答案。"""
+        thought, actions, final_answer = self._scan(text)
+        if actions or final_answer is not None or "Action:" not in text:
+            return thought, actions, final_answer
+
+        # 格式不规范(如Action不在行首、Action:后换行)时退回到正则解析
+        thought_match = _THOUGHT_RE.search(text)
         thought = thought_match.group(1).strip() if thought_match else None
-        action = action_match.group(1).strip() if action_match else None
-        return thought, action
+        actions = [a.strip() for a in _ACTION_RE.findall(text) if a.strip()]
+        if any(action.startswith("Finish[") for action in actions):
+            final_answer = self._finish_answer(text[text.index("Finish[") + len("Finish["):])
+        return thought, actions, final_answer
 
     def _parse_action(self, action_text: str):
         """解析Action字符串，提取工具名称和输入。"""
-        match = re.match(r"(\w+)\[(.*)\]", action_text)
+        match = _TOOLCALL_RE.match(action_text)
         if match:
             return match.group(1), match.group(2)
         return None, None
 
-    def run(self, question: str):
+    async def _execute_tool(self, tool_name: str, tool_input: str) -> str:
+        """
+        执行单个工具:异步工具直接await，阻塞工具放入线程池，超过 tool_timeout 视为失败。
+        注意超时无法中断正在运行的阻塞工具，它会继续占用线程池中的一个线程直到自行返回。
+        """
+        tool_function = self.tool_executor.getTool(tool_name)
+        if not tool_function:
+            return f"错误:未找到名为 '{tool_name}' 的工具。"
+        hits_before = tool_function.cache_info().hits if hasattr(tool_function, "cache_info") else None
+        if inspect.iscoroutinefunction(tool_function):
+            call = tool_function(tool_input)
+        else:
+            loop = asyncio.get_running_loop()
+            call = loop.run_in_executor(self._tool_pool, tool_function, tool_input)
+        try:
+            observation = await asyncio.wait_for(call, self.tool_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"警告:工具 '{tool_name}' 执行超时。")
+            return f"错误:工具 '{tool_name}' 执行超过 {self.tool_timeout} 秒未返回。"
+        except Exception as e:
+            # 单个工具失败只影响它自己的观察结果，同一步里并行的其他Action照常完成
+            logger.error(f"❌ 工具 '{tool_name}' 执行失败: {e}")
+            return f"错误:工具 '{tool_name}' 执行失败: {e}"
+        if hits_before is not None and tool_function.cache_info().hits > hits_before:
+            # 缓存命中时照常返回观察结果，只额外记一条日志。命中计数由并发调用共享，
+            # 同一步并行的多个调用可能互相影响，这条日志只作参考，不保证准确
+            logger.info(f"♻️ 工具 '{tool_name}' 命中缓存: {tool_input}")
+        return observation
+
+    async def run(self, question: str):
         """
         运行ReAct智能体来回答一个问题。
+        同一步中的多个Action会被并发执行。
         """
-        self.history = [] # 每次运行时重置历史记录
+        self._history_buf = io.StringIO() # 每次运行时重置历史记录
         current_step = 0
 
+        tools_desc = self.tool_executor.getAvailableTools()
+        prompt_prefix = self._prefix_tmpl.format(tools=tools_desc, question=question)
+
         while current_step < self.max_steps:
             current_step += 1
             logger.info(f"--- 第 {current_step} 步 ---")
 
             # 1. 格式化提示词
-            tools_desc = self.tool_executor.getAvailableTools()
-            history_str = "\n".join(self.history)
-            prompt = self.system_prompt_tmpl.format(
-                tools=tools_desc,
-                question=question,
-                history=history_str
-            )
+            prompt = prompt_prefix + self._history_buf.getvalue()
 
             logger.info(f"📝 当前提示词: \n{prompt}\n")
 
             # 2. 调用LLM进行思考
             messages = [{"role": "user", "content": prompt}]
-            response_text = self.llm_client.think(messages=messages)
+            response_text = await self.llm_client.think_async(
+                messages=messages, stop_predicate=_ActionStopDetector()
+            )
             
             if not response_text:
                 logger.error("错误:LLM未能返回有效响应。")
                 break
 
             # 3. 解析LLM的输出
-            thought, action = self._parse_output(response_text)
+            thought, actions, final_answer = self._parse_output(response_text)
             
             if thought:
                 logger.info(f"思考: {thought}")
 
-            if not action:
-                logger.warning("警告:未能解析出有效的Action，流程终止。")
-                break
-
             # 4. 执行Action
-            if action.startswith("Finish"):
-                # 如果是Finish指令，提取最终答案并结束
-                final_answer = re.match(r"Finish\[(.*)\]", action).group(1)
+            if final_answer is not None:
+                # 如果是Finish指令，直接返回最终答案并结束
                 logger.info(f"🎉 最终答案: {final_answer}")
                 return final_answer
-            
-            tool_name, tool_input = self._parse_action(action)
-            if not tool_name or not tool_input:
-                # ... 处理无效Action格式 ...
-                continue
 
-            logger.info(f"🎬 行动: {tool_name}[{tool_input}]")
-            
-            tool_function = self.tool_executor.getTool(tool_name)
-            if not tool_function:
-                observation = f"错误:未找到名为 '{tool_name}' 的工具。"
-            else:
-                observation = tool_function(tool_input) # 调用真实工具
+            if not actions:
+                logger.warning("警告:未能解析出有效的Action，流程终止。")
+                break
 
-            
-            logger.info(f"👀 观察: {observation}")
-            
-            # 将本轮的Action和Observation添加到历史记录中
-            self.history.append(f"Action: {action}")
-            self.history.append(f"Observation: {observation}")
+            tool_calls = []
+            for action in actions:
+                tool_name, tool_input = self._parse_action(action)
+                if not tool_name or not tool_input:
+                    # ... 处理无效Action格式 ...
+                    continue
+                logger.info(f"🎬 行动: {tool_name}[{tool_input}]")
+                tool_calls.append((action, tool_name, tool_input))
+
+            if not tool_calls:
+                # 提示词没有变化，重试只会得到同样的输出
+                logger.warning("警告:所有Action的格式都无效，流程终止。")
+                break
+
+            observations = await asyncio.gather(
+                *(self._execute_tool(tool_name, tool_input) for _, tool_name, tool_input in tool_calls)
+            )
+
+            # 按Action顺序将本轮的Action和Observation添加到历史记录中
+            for (action, _, _), observation in zip(tool_calls, observations):
+                logger.info(f"👀 观察: {observation}")
+                self._history_buf.write("Action: ")
+                self._history_buf.write(action)
+                self._history_buf.write("\nObservation: ")
+                self._history_buf.write(str(observation))
+                self._history_buf.write("\n")
 
         # 循环结束
         logger.info("已达到最大步数，流程终止。")
 
 
+async def run_samples(agents, question: str):
+    """对同一个问题并发运行多个智能体采样，返回各自的最终答案。"""
+    return await asyncio.gather(*(agent.run(question) for agent in agents))
+
+
 if __name__ == '__main__':
     prompt_file = "./prompts/promptReAct.txt"
     system_prompt_tmpl = load_system_prompt(prompt_file)
     llm = LLMClient()
+    # 多个采样的提示词在前几步完全相同，经过批处理器会被合并成一次 n>1 的调用
+    batcher = LLMBatcher(llm)
     tool_executor = ToolExecutor()
     search_desc = "一个网页搜索引擎。当你需要回答关于时事、事实以及在你的知识库中找不到的信息时，应使用此工具。"
-    tool_executor.registerTool("Search", search_desc, search)
-    agent = ReActAgent(llm_client=llm, tool_executor=tool_executor, system_prompt_tmpl=system_prompt_tmpl)
+    tool_executor.registerTool("Search", search_desc, search, cacheable=True)
+    tool_pool = ThreadPoolExecutor(max_workers=8)
+    num_samples = int(os.getenv("REACT_SAMPLES", 1))
+    agents = [
+        ReActAgent(llm_client=batcher, tool_executor=tool_executor, system_prompt_tmpl=system_prompt_tmpl, tool_pool=tool_pool)
+        for _ in range(num_samples)
+    ]
     question = "google最新的手机是哪一款？它的主要卖点是什么？"
-    agent.run(question)
+
+    async def main():
+        try:
+            return await run_samples(agents, question)
+        finally:
+            await batcher.close()
+
+    try:
+        for i, answer in enumerate(asyncio.run(main()), 1):
+            logger.info(f"采样 {i}: {answer}")
+    finally:
+        tool_pool.shutdown()
 
@@ -1,7 +1,10 @@
 import os
-from typing import List, Dict
+import sys
+import json
+import asyncio
+from typing import List, Dict, Callable, Optional
 
-from openai import OpenAI
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
 from loguru import logger
 
@@ -14,46 +17,240 @@ class LLMClient:
     一个用于调用任何兼容OpenAI接口的LLM服务的客户端。
     它用于调用任何兼容OpenAI接口的服务，并默认使用流式响应。
     """
-    def __init__(self, model: str = None, apiKey: str = None, baseUrl: str = None, timeout: int = None):
+    def __init__(self, model: str = None, apiKey: str = None, baseUrl: str = None, timeout: int = None,
+                 maxConcurrency: int = None, verbose: bool = True):
         """
         初始化客户端。优先使用传入参数，如果未提供，则从环境变量加载。
+        maxConcurrency 限制同一客户端上同时进行的请求数(建议 2~8)。
+        verbose 为 False 时不在终端实时打印流式输出。
         """
         self.model = model or os.getenv("MODEL_ID")
+        self.verbose = verbose
         apiKey = apiKey or os.getenv("API_KEY")
         baseUrl = baseUrl or os.getenv("BASE_URL")
         timeout = timeout or int(os.getenv("TIMEOUT", 60))
+        maxConcurrency = maxConcurrency or int(os.getenv("MAX_CONCURRENCY", 4))
         
         if not all([self.model, apiKey, baseUrl]):
             raise ValueError("模型ID、API密钥和服务地址必须被提供或在.env文件中定义。")
 
-        self.client = OpenAI(api_key=apiKey, base_url=baseUrl, timeout=timeout)
+        self.client = AsyncOpenAI(api_key=apiKey, base_url=baseUrl, timeout=timeout)
+        self._sem = asyncio.Semaphore(maxConcurrency)
+        # 同步调用复用同一个事件循环，避免异步连接池跨事件循环失效
+        self._loop = None
 
-    def think(self, messages: List[Dict[str, str]], temperature: float = 0.3) -> str:
+    async def think_async(self, messages: List[Dict[str, str]], temperature: float = 0.3,
+                          stop_predicate: Optional[Callable[[str], bool]] = None) -> str:
         """
-        调用大语言模型进行思考，并返回其响应。
+        异步调用大语言模型进行思考，并返回其响应。
+        如果提供了 stop_predicate，每收到一段新内容都会用这段内容调用它(需要上下文的
+        判断由调用方自行累积)，返回 True 时立即中断流式生成并返回已收到的部分。
         """
-        logger.info(f"🧠 正在调用 {self.model} 模型...")
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=temperature,
-                stream=True,
+        async with self._sem:
+            logger.info(f"🧠 正在调用 {self.model} 模型...")
+            try:
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=temperature,
+                    stream=True,
+                )
+
+                # 处理流式响应
+                logger.info("✅ 大语言模型响应成功:")
+                collected_content = []
+                line_buf = []
+                async for chunk in response:
+                    content = chunk.choices[0].delta.content
+                    if not content:
+                        continue
+                    collected_content.append(content)
+                    if self.verbose:
+                        # 按行刷新终端，避免每个token都触发一次flush
+                        line_buf.append(content)
+                        if "\n" in content:
+                            sys.stdout.write("".join(line_buf))
+                            sys.stdout.flush()
+                            line_buf.clear()
+                    if stop_predicate and stop_predicate(content):
+                        # 已拿到需要的内容，关闭连接以停止生成剩余token
+                        await response.close()
+                        break
+                if self.verbose:
+                    line_buf.append("\n")  # 在流式输出结束后换行
+                    sys.stdout.write("".join(line_buf))
+                    sys.stdout.flush()
+                return "".join(collected_content)
+
+            except Exception as e:
+                logger.error(f"❌ 调用LLM API时发生错误: {e}")
+                return None
+
+    async def think_n_async(self, messages: List[Dict[str, str]], n: int, temperature: float = 0.3) -> List[str]:
+        """
+        对同一组消息一次请求采样 n 个回答(非流式)，用于合并完全相同的并发请求。
+        """
+        async with self._sem:
+            logger.info(f"🧠 正在调用 {self.model} 模型 (n={n})...")
+            try:
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=temperature,
+                    n=n,
+                )
+                logger.info("✅ 大语言模型响应成功。")
+                choices = sorted(response.choices, key=lambda choice: choice.index)
+                results = [choice.message.content for choice in choices][:n]
+
+            except Exception as e:
+                logger.error(f"❌ 调用LLM API时发生错误: {e}")
+                return [None] * n
+
+        # 部分服务会忽略 n 参数，缺少的回答逐个补发(需在释放信号量之后，避免占满并发额度)
+        missing = n - len(results)
+        if missing > 0:
+            logger.warning(f"警告:服务只返回了 {len(results)}/{n} 个回答，补发 {missing} 次请求。")
+            results += await asyncio.gather(
+                *(self.think_async(messages, temperature) for _ in range(missing))
             )
-            
-            # 处理流式响应
-            logger.info("✅ 大语言模型响应成功:")
-            collected_content = []
-            for chunk in response:
-                content = chunk.choices[0].delta.content or ""
-                print(content, end="", flush=True)
-                collected_content.append(content)
-            print()  # 在流式输出结束后换行
-            return "".join(collected_content)
+        return results
+
+    def think(self, messages: List[Dict[str, str]], temperature: float = 0.3,
+              stop_predicate: Optional[Callable[[str], bool]] = None) -> str:
+        """
+        think_async 的同步封装，供尚未迁移到异步的调用方使用。
+        """
+        if self._loop is None or self._loop.is_closed():
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(self.think_async(messages, temperature, stop_predicate))
+
+
+class LLMBatcher:
+    """
+    在 LLMClient 前面做自动批处理:在 batch_wait_timeout_s 时间窗口内到达的并发
+    think_async 调用会被收集成一批(最多 max_batch_size 个)统一下发。
+    同一批中消息和温度完全相同的请求合并为一次 n>1 的非流式调用，其余请求并发执行。
+    合并后的请求在拿到各自的回答后再按自己的 stop_predicate 截断，效果与流式时提前停止一致。
+    对外提供与 LLMClient.think_async 相同的接口，可以直接传给智能体使用
+    (例如对同一问题并发运行多个智能体采样时，相同的提示词会被合并)。
+    """
+    def __init__(self, llm_client: LLMClient, max_batch_size: int = 32, batch_wait_timeout_s: float = 0.01):
+        self.llm_client = llm_client
+        self.model = llm_client.model
+        self.max_batch_size = max_batch_size
+        self.batch_wait_timeout_s = batch_wait_timeout_s
+        self._queue = None
+        self._worker = None
+        self._batch = [] # 正在收集中的批次
+        self._dispatch_tasks = set() # 保留下发任务的引用，避免运行中被垃圾回收
 
+    async def think_async(self, messages: List[Dict[str, str]], temperature: float = 0.3,
+                          stop_predicate: Optional[Callable[[str], bool]] = None) -> str:
+        """
+        将请求放入队列，等待所在批次完成后返回响应。
+        """
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._collect_batches())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((messages, temperature, stop_predicate, future))
+        return await future
+
+    async def close(self):
+        """
+        停止后台的批处理任务，并取消所有尚未完成的请求。
+        """
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        # 队列中和正在收集的批次里的请求还未下发，直接取消
+        pending = self._batch
+        self._batch = []
+        while self._queue is not None and not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for *_, future in pending:
+            if not future.done():
+                future.cancel()
+
+        # 已下发的请求随任务一起取消，_run_group 会取消对应的 future
+        tasks = list(self._dispatch_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _collect_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._batch = batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_wait_timeout_s
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            self._batch = []
+            # 下发交给独立任务，收集下一批不必等待本批完成
+            task = asyncio.create_task(self._dispatch(batch))
+            self._dispatch_tasks.add(task)
+            task.add_done_callback(self._dispatch_tasks.discard)
+
+    async def _dispatch(self, batch):
+        groups: Dict[tuple, list] = {}
+        for item in batch:
+            messages, temperature, _, _ = item
+            key = (json.dumps(messages, ensure_ascii=False, sort_keys=True), temperature)
+            groups.setdefault(key, []).append(item)
+
+        logger.info(f"📦 批处理 {len(batch)} 个请求，合并为 {len(groups)} 次调用。")
+        await asyncio.gather(*(self._run_group(items) for items in groups.values()))
+
+    async def _run_group(self, items):
+        messages, temperature, stop_predicate, _ = items[0]
+        try:
+            if len(items) == 1:
+                results = [await self.llm_client.think_async(messages, temperature, stop_predicate)]
+            else:
+                results = await self.llm_client.think_n_async(messages, len(items), temperature)
+                results = [
+                    self._truncate(result, item_predicate)
+                    for (_, _, item_predicate, _), result in zip(items, results)
+                ]
+        except asyncio.CancelledError:
+            for *_, future in items:
+                if not future.done():
+                    future.cancel()
+            raise
         except Exception as e:
-            logger.error(f"❌ 调用LLM API时发生错误: {e}")
-            return None
+            for *_, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (*_, future), result in zip(items, results):
+            if not future.done():
+                future.set_result(result)
+
+    @staticmethod
+    def _truncate(text: Optional[str], stop_predicate: Optional[Callable[[str], bool]]) -> Optional[str]:
+        """
+        非流式拿到的回答按行喂给 stop_predicate，在它返回 True 的位置截断。
+        """
+        if text is None or stop_predicate is None:
+            return text
+        consumed = 0
+        for piece in text.splitlines(keepends=True):
+            consumed += len(piece)
+            if stop_predicate(piece):
+                return text[:consumed]
+        return text
 
 # --- 客户端使用示例 ---
 if __name__ == '__main__':
@@ -1,3 +1,6 @@
+import json
+import functools
+import inspect
 from typing import Dict, Any
 
 from loguru import logger
@@ -11,14 +14,22 @@ class ToolExecutor:
     """
     def __init__(self):
         self.tools: Dict[str, Dict[str, Any]] = {}
+        self._tools_desc = None # 工具描述的缓存，注册新工具时失效
 
-    def registerTool(self, name: str, description: str, func: callable):
+    def registerTool(self, name: str, description: str, func: callable, cacheable: bool = False):
         """
         向工具箱中注册一个新工具。
+        cacheable 为 True 时，相同输入的调用结果会被缓存(仅适用于幂等的同步工具)。
         """
         if name in self.tools:
             logger.warning(f"警告:工具 '{name}' 已存在，将被覆盖。")
+        if cacheable:
+            if inspect.iscoroutinefunction(func):
+                logger.warning(f"警告:异步工具 '{name}' 不支持缓存，将直接调用。")
+            else:
+                func = functools.lru_cache(maxsize=256)(func)
         self.tools[name] = {"description": description, "func": func}
+        self._tools_desc = None
         logger.info(f"工具 '{name}' 已注册。")
 
     def getTool(self, name: str) -> callable:
@@ -29,12 +40,14 @@ class ToolExecutor:
 
     def getAvailableTools(self) -> str:
         """
-        获取所有可用工具的格式化描述字符串。
+        获取所有可用工具的描述，格式为紧凑的JSON数组以节省提示词token。
         """
-        return "\n".join([
-            f"- {name}: {tool['description']}" 
-            for name, tool in self.tools.items()
-        ])
+        if self._tools_desc is None:
+            self._tools_desc = json.dumps([
+                {"name": name, "desc": tool["description"]}
+                for name, tool in self.tools.items()
+            ], ensure_ascii=False, separators=(",", ":"))
+        return self._tools_desc
     
 
 # --- 工具初始化与使用示例 ---
@@ -47,7 +60,7 @@ if __name__ == '__main__':
 
     # 2. 注册我们的实战搜索工具
     search_description = "一个网页搜索引擎。当你需要回答关于时事、事实以及在你的知识库中找不到的信息时，应使用此工具。"
-    toolExecutor.registerTool("Search", search_description, search)
+    toolExecutor.registerTool("Search", search_description, search, cacheable=True)
     
     # 3. 打印可用的工具
     print("\n--- 可用的工具 ---")
@@ -1,5 +1,9 @@
+import re
 
 
 def load_system_prompt(file_path: str) -> str:
     with open(file_path, 'r', encoding='utf-8') as file:
-        return file.read().strip()
+        tmpl = file.read().strip()
+    # 压缩空白以减少输入token:合并连续的空格/制表符，并去掉行尾空白
+    tmpl = re.sub(r"[ \t]+", " ", tmpl)
+    return re.sub(r" +\n", "\n", tmpl)
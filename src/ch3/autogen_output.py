@@ -1,9 +1,11 @@
 import streamlit as st
 import requests
+import orjson
 import pandas as pd
 import time
 from datetime import datetime
-from tenacity import retry, stop_after_attempt, wait_exponential
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 # 设置页面配置
@@ -72,9 +74,31 @@ st.markdown("""
 COINGECKO_API_URL = "https://api.coingecko.com/api/v3/simple/price"
 BITCOGECKO_ID = "bitcoin"
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-def fetch_bitcoin_data():
-    """获取比特币价格数据"""
+@st.cache_resource
+def get_http_session():
+    """
+    复用同一个会话，保持与CoinGecko的TCP/TLS连接；重试交给连接适配器处理。
+    Streamlit每次重新运行都会执行整个脚本，所以会话需要放在资源缓存中。
+    """
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=4,
+        # 不遵循 Retry-After:CoinGecko限流时可能给出很长的等待时间，会让页面在渲染前长时间阻塞
+        max_retries=Retry(
+            total=3,
+            backoff_factor=1,
+            status_forcelist=[429, 500, 502, 503, 504],
+            respect_retry_after_header=False,
+        ),
+    ))
+    return session
+
+# 缓存TTL内的重复渲染直接命中缓存，只有缓存未命中时才会请求API。
+# 出错时直接抛出异常，st.cache_data 不会缓存异常，失败不会在TTL内被反复展示
+@st.cache_data(ttl=30, show_spinner=False)
+def fetch_bitcoin_price():
+    """请求CoinGecko获取比特币价格数据，只缓存成功的结果"""
     params = {
         'ids': BITCOGECKO_ID,
         'vs_currencies': 'usd',
@@ -83,29 +107,33 @@ def fetch_bitcoin_data():
         'include_last_updated_at': 'true'
     }
     
+    response = get_http_session().get(COINGECKO_API_URL, params=params, timeout=10)
+    response.raise_for_status()
+    data = orjson.loads(response.content)
+    
+    # 解析数据
+    bitcoin_data = data[BITCOGECKO_ID]
+    current_price = bitcoin_data['usd']
+    price_change_24h = bitcoin_data['usd_24h_change']
+    last_updated = bitcoin_data['last_updated_at']
+    
+    return {
+        'current_price': current_price,
+        'price_change_24h': price_change_24h,
+        'last_updated': last_updated,
+        'status': 'success'
+    }
+
+def fetch_bitcoin_data():
+    """获取比特币价格数据，将异常转换为错误信息"""
     try:
-        response = requests.get(COINGECKO_API_URL, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        
-        # 解析数据
-        bitcoin_data = data[BITCOGECKO_ID]
-        current_price = bitcoin_data['usd']
-        price_change_24h = bitcoin_data['usd_24h_change']
-        last_updated = bitcoin_data['last_updated_at']
-        
-        return {
-            'current_price': current_price,
-            'price_change_24h': price_change_24h,
-            'last_updated': last_updated,
-            'status': 'success'
-        }
+        return fetch_bitcoin_price()
     except requests.exceptions.RequestException as e:
         return {
             'status': 'error',
             'message': f"网络请求错误: {str(e)}"
         }
-    except KeyError as e:
+    except (KeyError, orjson.JSONDecodeError) as e:
         return {
             'status': 'error',
             'message': f"数据解析错误: {str(e)}"
@@ -138,27 +166,24 @@ def display_bitcoin_price():
         last_updated = datetime.fromtimestamp(data['last_updated'])
         
         # 价格容器
-        st.markdown("""
+        change_class = "positive" if price_change_24h >= 0 else "negative"
+        st.markdown(f"""
         <div class="price-container">
             <h1>比特币价格 (BTC/USD)</h1>
-            <div class="price">{}</div>
-            <div class="price-change {}">{}</div>
-            <p>最后更新: {}</p>
+            <div class="price">{format_price(current_price)}</div>
+            <div class="price-change {change_class}">{format_change(price_change_24h)}</div>
+            <p>最后更新: {last_updated:%Y-%m-%d %H:%M:%S}</p>
         </div>
-        """.format(
-            format_price(current_price),
-            "positive" if price_change_24h >= 0 else "negative",
-            format_change(price_change_24h),
-            last_updated.strftime("%Y-%m-%d %H:%M:%S")
-        ), unsafe_allow_html=True)
+        """, unsafe_allow_html=True)
     else:
         # 显示错误信息
         st.error(f"获取比特币价格失败: {data['message']}")
     
     # 刷新按钮
     if st.button("刷新价格", key="refresh_button"):
-        # 强制刷新数据
-        st.experimental_rerun()
+        # 强制刷新数据:先清除缓存，否则重新运行仍会命中缓存
+        fetch_bitcoin_price.clear()
+        st.rerun()
 
 # 主应用界面
 def main():